@@ -1,4 +1,5 @@
 import logging
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 import sys
 from pathlib import Path
 import traceback
@@ -6,45 +7,247 @@ import getpass
 import json
 from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import Optional, Deque, Iterable, Any
-from collections import deque
+from typing import Optional, Iterable, Any, Dict, Tuple
 import os
+import time
+import atexit
+import queue
+import threading
+import weakref
 from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+
+try:
+    import orjson  # opcional: pip install "framework-cg[json]"
+except ImportError:
+    orjson = None
 
 load_dotenv('config/.env')
+load_dotenv('.env')
+
+# Níveis aceitos (e sinônimos) -> nível normalizado do ProcessLogger
+_LEVEL_ALIASES = {
+    "DEBUG": "DEBUG", "INFO": "INFO", "WARN": "WARN", "WARNING": "WARN",
+    "ERROR": "ERROR", "FATAL": "FATAL", "CRITICAL": "FATAL",
+}
+# Nível normalizado -> nível do módulo logging
+_LEVEL_MAP = {
+    "DEBUG": logging.DEBUG, "INFO": logging.INFO, "WARN": logging.WARNING,
+    "ERROR": logging.ERROR, "FATAL": logging.CRITICAL,
+}
+
+
+# SQL de processamento nas duas variantes de schema (com/sem coluna 'mensagem')
+_INSERT_COM_MSG = """
+    INSERT INTO processamento (nome_processo, inicio, fim, usuario, status, mensagem)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    RETURNING id
+"""
+_INSERT_SEM_MSG = """
+    INSERT INTO processamento (nome_processo, inicio, fim, usuario, status)
+    VALUES (%s, %s, %s, %s, %s)
+    RETURNING id
+"""
+_UPDATE_COM_MSG = """
+    UPDATE processamento
+       SET inicio = %s,
+           fim = %s,
+           status = %s,
+           mensagem = %s
+     WHERE id = %s
+"""
+_UPDATE_SEM_MSG = """
+    UPDATE processamento
+       SET inicio = %s,
+           fim = %s,
+           status = %s
+     WHERE id = %s
+"""
+
+
+def _json_dumps(obj: Any) -> str:
+    """Serializa para JSON com orjson quando disponível; tipos desconhecidos viram str."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, default=str, ensure_ascii=False)
+
+
+class JsonLineFormatter(logging.Formatter):
+    """Formata cada registro como uma linha JSON: {"ts", "lvl", "msg"[, "exc"]}."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {"ts": record.created, "lvl": record.levelname, "msg": record.getMessage()}
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return _json_dumps(payload)
+
+
+class BatchedRotatingFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler que acumula os registros já codificados num buffer e os
+    grava com os.write num fd aberto com O_APPEND, em blocos:
+      - quando o buffer passa de buffer_size bytes;
+      - em registros ERROR ou mais graves (o erro não fica retido no buffer);
+      - a cada flush_interval_s (também por uma thread de fundo, com o logger ocioso);
+      - no close/rotação.
+    """
+
+    def __init__(self, filename, maxBytes: int = 0, backupCount: int = 0, encoding: str = "utf-8",
+                 buffer_size: int = 512 * 1024, flush_interval_s: float = 1.0):
+        self._buf = bytearray()
+        self._buffer_size = buffer_size
+        self._flush_interval_s = flush_interval_s
+        self._last_flush = time.monotonic()
+        self._size = 0  # tamanho do arquivo atual, sem o buffer
+        super().__init__(filename, mode="a", maxBytes=maxBytes, backupCount=backupCount, encoding=encoding)
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="BatchedRotatingFileHandler", daemon=True)
+        self._flusher.start()
+
+    def _open(self):
+        fd = os.open(self.baseFilename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._size = os.fstat(fd).st_size
+        return os.fdopen(fd, "ab", buffering=0)
+
+    def _write_buffer(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._buf or self.stream is None:
+            return
+        buf, self._buf = self._buf, bytearray()
+        fd = self.stream.fileno()
+        mv = memoryview(buf)
+        while mv:
+            mv = mv[os.write(fd, mv):]
+        self._size += len(buf)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            data = (self.format(record) + self.terminator).encode(self.encoding or "utf-8", self.errors or "strict")
+            if self.stream is None:
+                self.stream = self._open()
+            pendente = self._size + len(self._buf)
+            if self.maxBytes > 0 and pendente > 0 and pendente + len(data) >= self.maxBytes:
+                self.doRollover()
+            self._buf += data
+            if (len(self._buf) >= self._buffer_size
+                    or record.levelno >= logging.ERROR
+                    or time.monotonic() - self._last_flush >= self._flush_interval_s):
+                self._write_buffer()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def doRollover(self) -> None:
+        self._write_buffer()
+        super().doRollover()
+
+    def flush(self) -> None:
+        with self.lock:
+            self._write_buffer()
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self._flush_interval_s):
+            if self._buf and time.monotonic() - self._last_flush >= self._flush_interval_s:
+                self.flush()
+
+    def close(self) -> None:
+        self._stop.set()
+        super().close()
+
 
 # =============================
 # Setup de logging por script
 # =============================
+# Listener (thread de I/O) de cada logger configurado, por script_name
+_listeners: Dict[str, Any] = {}
+# Última configuração aplicada por script_name: (parâmetros, logger, caminho do log)
+_configured: Dict[str, Tuple[tuple, logging.Logger, str]] = {}
+_setup_lock = threading.Lock()
+
+
+def _parar_listener(script_name: str) -> None:
+    listener = _listeners.pop(script_name, None)
+    if listener is None:
+        return
+    listener.stop()  # esvazia a fila antes de parar
+    for h in listener.handlers:
+        try:
+            h.close()
+        except Exception:
+            pass
+
+
+@atexit.register
+def _parar_listeners() -> None:
+    for nome in list(_listeners):
+        _parar_listener(nome)
+
+
+# ProcessLoggers com thread de gravação ativa; um único hook de atexit fecha todos
+_loggers_ativos: "weakref.WeakSet[ProcessLogger]" = weakref.WeakSet()
+# Item de fila que encerra a thread de gravação (ver ProcessLogger.close)
+_PARAR = object()
+
+
+@atexit.register
+def _fechar_loggers() -> None:
+    for lg in list(_loggers_ativos):
+        try:
+            lg.close()
+        except Exception:
+            pass
+
+
 def setup_script_logger(
     logs_dir: str | None = None,
     script_name: Optional[str] = None,
     overwrite: bool = True,
     level: int = logging.INFO,
     fmt: str = "%(asctime)s - %(levelname)s - %(message)s",
+    json_format: bool = False,
 ):
     """
     Configura logger para scripts Dockerizados com rotação de arquivo.
     - Se overwrite=True, apaga o arquivo anterior e inicia novo log.
     - Sempre escreve também no stdout.
+    - Se json_format=True, o arquivo recebe uma linha JSON por registro (JsonLineFormatter).
+    - O logger só enfileira os registros (QueueHandler); formatação e escrita em
+      console/arquivo ficam numa thread dedicada (QueueListener), parada no exit.
+    - Chamadas repetidas com os mesmos parâmetros devolvem o logger já configurado.
     """
 
     # Diretório base
     logs_dir = logs_dir or os.getenv("LOG_DIR", "/app/logs")
-    if not Path(logs_dir).exists() and logs_dir == "/app/logs":
-        logs_dir = "logs"
-    Path(logs_dir).mkdir(parents=True, exist_ok=True)
 
     # Nome do log = nome script
     if script_name is None:
         script_name = Path(sys.argv[0]).stem or "app"
 
+    key = (logs_dir, level, overwrite, fmt, json_format)
+    with _setup_lock:
+        cached = _configured.get(script_name)
+        if cached is not None and cached[0] == key and script_name in _listeners:
+            return cached[1], cached[2]
+        logger, log_path = _configurar_logger(logs_dir, script_name, overwrite, level, fmt, json_format)
+        _configured[script_name] = (key, logger, log_path)
+        return logger, log_path
+
+
+def _configurar_logger(logs_dir: str, script_name: str, overwrite: bool, level: int,
+                       fmt: str, json_format: bool) -> Tuple[logging.Logger, str]:
+    if logs_dir == "/app/logs" and not os.path.isdir(logs_dir):
+        logs_dir = "logs"
+    os.makedirs(logs_dir, exist_ok=True)
+
     log_path = Path(logs_dir) / f"{script_name}.log"
 
     # Apagar log antigos
-    if overwrite and log_path.exists():
+    if overwrite:
         try:
             log_path.unlink()
+        except FileNotFoundError:
+            pass
         except Exception as e:
             print(f"[WARN] Falha ao limpar log antigo {log_path}: {e}")
 
@@ -52,6 +255,7 @@ def setup_script_logger(
     logger.setLevel(level)
     logger.propagate = False
 
+    _parar_listener(script_name)
     for h in list(logger.handlers):
         logger.removeHandler(h)
         try:
@@ -64,20 +268,22 @@ def setup_script_logger(
     ch = logging.StreamHandler(sys.stdout)
     ch.setLevel(level)
     ch.setFormatter(formatter)
-    logger.addHandler(ch)
 
-    from logging.handlers import RotatingFileHandler
-    file_mode = "w" if overwrite else "a"
-    fh = RotatingFileHandler(
+    # overwrite é resolvido pelo unlink acima; o arquivo é sempre aberto em append
+    fh = BatchedRotatingFileHandler(
         log_path,
         maxBytes=5_000_000,
         backupCount=3,
         encoding="utf-8",
-        mode=file_mode
     )
     fh.setLevel(level)
-    fh.setFormatter(formatter)
-    logger.addHandler(fh)
+    fh.setFormatter(JsonLineFormatter() if json_format else formatter)
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, ch, fh, respect_handler_level=True)
+    listener.start()
+    _listeners[script_name] = listener
 
     return logger, str(log_path)
 
@@ -92,6 +298,10 @@ class ProcessLogger:
     Adapta os SQLs se a coluna 'mensagem' não existir.
     """
 
+    # Resultado da introspecção compartilhado entre instâncias: (banco, papel) -> tem 'mensagem'
+    _schema_cache: Dict[Tuple[Optional[str], Optional[str]], bool] = {}
+    _schema_cache_lock = threading.Lock()
+
     def __init__(
         self,
         usuario: Optional[str],
@@ -99,15 +309,37 @@ class ProcessLogger:
         logger: Optional[logging.Logger] = None,
         max_db_chars: int = 4000,
         log_to_db_levels: Iterable[str] = ("WARN", "ERROR", "FATAL"),
+        flush_every: int = 200,
+        flush_interval_s: float = 1.0,
+        queue_maxsize: int = 10_000,
     ):
         self.db_name = db_name
         self.usuario = usuario or getpass.getuser()
         self.logger = logger or logging.getLogger(Path(sys.argv[0]).stem or "app")
-        self._buffer: Deque[str] = deque(maxlen=5000)
         self._max_db_chars = max_db_chars
-        self._log_to_db_levels = {self._norm_level(lvl) for lvl in log_to_db_levels}
+        # Ring buffer (bytes UTF-8) com as últimas linhas, usado no resumo gravado no banco
+        self._ring = bytearray(max(1, max_db_chars * 2))
+        self._ring_head = 0
+        self._ring_size = 0
+        self._ring_truncado = False
+        self._ring_lock = threading.Lock()
+        self._ts_cache: Tuple[int, str] = (-1, "")
+        self._log_to_db_levels = frozenset(self._norm_level(lvl) for lvl in log_to_db_levels)
         self._processamento_id: Optional[int] = None
-        self._has_mensagem_col: Optional[bool] = None  
+        self._has_mensagem_col: Optional[bool] = None
+        # SQL e montagem de parâmetros escolhidos uma vez, após a introspecção
+        self._insert_sql: Optional[str] = None
+        self._update_sql: Optional[str] = None
+        self._insert_row = None
+        self._update_row = None
+        self._db = None
+        # Eventos de processamento_log consumidos em lote por uma thread de fundo
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_maxsize)
+        self._flush_every = max(1, int(flush_every))
+        self._flush_interval_s = flush_interval_s
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        self._eventos_descartados = 0
 
     @staticmethod
     def _coerce_logger(logger_like: Any) -> logging.Logger:
@@ -129,11 +361,7 @@ class ProcessLogger:
 
     @staticmethod
     def _norm_level(level: str) -> str:
-        m = str(level).upper()
-        if m in {"DEBUG", "INFO", "WARN", "ERROR", "FATAL"}: return m
-        if m == "WARNING": return "WARN"
-        if m == "CRITICAL": return "FATAL"
-        return "INFO"
+        return _LEVEL_ALIASES.get(str(level).upper(), "INFO")
 
     @staticmethod
     def _status_success() -> str: return "SUCCESS"
@@ -142,59 +370,133 @@ class ProcessLogger:
     @staticmethod
     def _status_error() -> str:   return "ERROR"
 
+    def _ring_append(self, linha: str) -> None:
+        data = memoryview((linha + "\n").encode("utf-8"))
+        n = len(data)
+        cap = len(self._ring)
+        with self._ring_lock:
+            if n >= cap:
+                self._ring[:] = data[n - cap:]
+                self._ring_head, self._ring_size, self._ring_truncado = 0, cap, True
+                return
+            tail = (self._ring_head + self._ring_size) % cap
+            primeiro = min(n, cap - tail)
+            self._ring[tail:tail + primeiro] = data[:primeiro]
+            if primeiro < n:
+                self._ring[:n - primeiro] = data[primeiro:]
+            excesso = self._ring_size + n - cap
+            if excesso > 0:
+                self._ring_head = (self._ring_head + excesso) % cap
+                self._ring_size = cap
+                self._ring_truncado = True
+            else:
+                self._ring_size += n
+
     def _buffer_compacto(self) -> str:
-        full = "\n".join(self._buffer)
-        if len(full) <= self._max_db_chars: return full
+        with self._ring_lock:
+            cap = len(self._ring)
+            inicio, fim = self._ring_head, self._ring_head + self._ring_size
+            if fim <= cap:
+                raw = bytes(self._ring[inicio:fim])
+            else:
+                raw = bytes(self._ring[inicio:]) + bytes(self._ring[:fim - cap])
+            truncado = self._ring_truncado
+        # o início pode cair no meio de um caractere multibyte quando o anel deu a volta
+        full = raw.decode("utf-8", errors="ignore")
+        if full.endswith("\n"):
+            full = full[:-1]
+        if not truncado and len(full) <= self._max_db_chars: return full
         head = "... (truncado) ...\n"
         return head + full[-(self._max_db_chars - len(head)) :]
 
+    def _timestamp(self) -> str:
+        # strftime só quando muda o segundo
+        agora = int(time.time())
+        seg, txt = self._ts_cache
+        if seg != agora:
+            txt = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(agora))
+            self._ts_cache = (agora, txt)
+        return txt
+
     # ---------- DB ops ----------
     def _get_conn(self):
-        from framework_cg.conn import PostgresConnection
-        db = PostgresConnection()
-        return db.conectar_postgres(db_name=self.db_name)
+        # Reaproveita o handler (e, por ele, o pool de conexões do processo)
+        if self._db is None:
+            from framework_cg.conn import PostgresConnection
+            self._db = PostgresConnection()
+        return self._db.conectar_postgres(db_name=self.db_name)
+
+    def _schema_cache_key(self) -> Tuple[Optional[str], Optional[str]]:
+        # current_schema() depende do search_path do papel conectado,
+        # então (banco, papel) identifica o schema inspecionado.
+        return (self.db_name or os.getenv("DB_NAME"),
+                os.getenv("DATABASE_URL") or os.getenv("DB_USER"))
 
     def _ensure_schema_introspection(self) -> None:
+        """Inspeciona o schema (uma vez) e fixa o SQL de processamento correspondente."""
+        if self._insert_sql is not None:
+            return
+        self._introspectar_schema()
+        # Parâmetros sempre na ordem da variante com 'mensagem'; sem a coluna, ela é descartada
+        if self._has_mensagem_col:
+            self._insert_sql, self._update_sql = _INSERT_COM_MSG, _UPDATE_COM_MSG
+            self._insert_row = lambda *a: a
+            self._update_row = lambda *a: a
+        else:
+            self._insert_sql, self._update_sql = _INSERT_SEM_MSG, _UPDATE_SEM_MSG
+            self._insert_row = lambda *a: a[:-1]
+            self._update_row = lambda *a: a[:3] + a[4:]
+
+    def _introspectar_schema(self) -> None:
         if self._has_mensagem_col is not None:
             return
-        try:
-            with self._get_conn() as conn:
-                if conn is None:
-                    self.logger.error("Conexão ao banco falhou (introspecção).")
-                    self._has_mensagem_col = False
-                    return
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT 1
-                          FROM information_schema.columns
-                         WHERE table_name = 'processamento'
-                           AND column_name = 'mensagem'
-                           AND table_schema = current_schema()
-                        LIMIT 1;
-                    """)
-                    self._has_mensagem_col = cur.fetchone() is not None
-            if not self._has_mensagem_col:
-                self.logger.info("Tabela processamento sem coluna 'mensagem' — SQL será adaptado.")
-        except Exception as e:
-            self.logger.warning("Falha ao inspecionar schema (assumindo sem 'mensagem'): %s: %s",
-                                type(e).__name__, e)
-            self._has_mensagem_col = False
+        key = self._schema_cache_key()
+        cached = self._schema_cache.get(key)
+        if cached is not None:
+            self._has_mensagem_col = cached
+            return
+        with self._schema_cache_lock:
+            cached = self._schema_cache.get(key)
+            if cached is not None:
+                self._has_mensagem_col = cached
+                return
+            try:
+                with self._get_conn() as conn:
+                    if conn is None:
+                        self.logger.error("Conexão ao banco falhou (introspecção).")
+                        self._has_mensagem_col = False
+                        return
+                    with conn.cursor() as cur:
+                        cur.execute("""
+                            SELECT 1
+                              FROM information_schema.columns
+                             WHERE table_name = 'processamento'
+                               AND column_name = 'mensagem'
+                               AND table_schema = current_schema()
+                            LIMIT 1;
+                        """)
+                        self._has_mensagem_col = cur.fetchone() is not None
+                # Só resultados reais vão para o cache; falhas são refeitas por outras instâncias
+                self._schema_cache[key] = self._has_mensagem_col
+                if not self._has_mensagem_col:
+                    self.logger.info("Tabela processamento sem coluna 'mensagem' — SQL será adaptado.")
+            except Exception as e:
+                self.logger.warning("Falha ao inspecionar schema (assumindo sem 'mensagem'): %s: %s",
+                                    type(e).__name__, e)
+                self._has_mensagem_col = False
 
     def log_mensagem(self, mensagem: str, level: str = "info",
                      etapa: Optional[str] = None, codigo: Optional[str] = None,
                      detalhe: Optional[dict] = None) -> None:
-        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        lvl = self._norm_level(level)
-        linha = f"{ts} - {lvl} - {mensagem}"
-        self._buffer.append(linha)
-
-        if lvl == "ERROR":   self.logger.error(mensagem)
-        elif lvl == "WARN":  self.logger.warning(mensagem)
-        elif lvl == "DEBUG": self.logger.debug(mensagem)
-        elif lvl == "FATAL": self.logger.critical(mensagem)
-        else:                self.logger.info(mensagem)
+        lvl = _LEVEL_ALIASES.get(str(level).upper(), "INFO")
+        lvl_int = _LEVEL_MAP[lvl]
+        # O ring buffer recebe todos os níveis: é o resumo gravado por execucao/registrar_execucao,
+        # independente do nível configurado no logger
+        self._ring_append(f"{self._timestamp()} - {lvl} - {mensagem}")
+        if self.logger.isEnabledFor(lvl_int):
+            self.logger.log(lvl_int, mensagem)
 
-        if self._processamento_id and (lvl in self._log_to_db_levels):
+        if self._processamento_id and lvl in self._log_to_db_levels:
             self.registrar_evento(
                 processamento_id=self._processamento_id,
                 level=lvl, etapa=etapa, codigo=codigo,
@@ -213,24 +515,11 @@ class ProcessLogger:
                     self.logger.error("Conexão ao banco falhou.")
                     return None
                 with conn.cursor() as cur:
-                    if self._has_mensagem_col:
-                        cur.execute(
-                            """
-                            INSERT INTO processamento (nome_processo, inicio, fim, usuario, status, mensagem)
-                            VALUES (%s, %s, %s, %s, %s, %s)
-                            RETURNING id
-                            """,
-                            (nome_processo, inicio, fim, usuario, self._status_running(), "(início da execução)"),
-                        )
-                    else:
-                        cur.execute(
-                            """
-                            INSERT INTO processamento (nome_processo, inicio, fim, usuario, status)
-                            VALUES (%s, %s, %s, %s, %s)
-                            RETURNING id
-                            """,
-                            (nome_processo, inicio, fim, usuario, self._status_running()),
-                        )
+                    cur.execute(
+                        self._insert_sql,
+                        self._insert_row(nome_processo, inicio, fim, usuario,
+                                         self._status_running(), "(início da execução)"),
+                    )
                     new_id = cur.fetchone()[0]
                 conn.commit()
             self._processamento_id = new_id
@@ -239,6 +528,10 @@ class ProcessLogger:
             self.logger.error("Erro ao registrar início: %s: %s", type(e).__name__, e)
             return None
 
+    def _sql_update(self, processamento_id: int, inicio: datetime, fim: datetime,
+                    status: str, mensagem: Optional[str]) -> Tuple[str, tuple]:
+        return self._update_sql, self._update_row(inicio, fim, status, mensagem, processamento_id)
+
     def atualizar_execucao(self, processamento_id: int, inicio: datetime, fim: datetime,
                            status: str, mensagem: Optional[str]) -> None:
         try:
@@ -248,33 +541,43 @@ class ProcessLogger:
                     self.logger.error("Conexão ao banco falhou (update).")
                     return
                 with conn.cursor() as cur:
-                    if self._has_mensagem_col:
-                        cur.execute(
-                            """
-                            UPDATE processamento
-                               SET inicio = %s,
-                                   fim = %s,
-                                   status = %s,
-                                   mensagem = %s
-                             WHERE id = %s
-                            """,
-                            (inicio, fim, status, mensagem, processamento_id),
-                        )
-                    else:
-                        cur.execute(
-                            """
-                            UPDATE processamento
-                               SET inicio = %s,
-                                   fim = %s,
-                                   status = %s
-                             WHERE id = %s
-                            """,
-                            (inicio, fim, status, processamento_id),
-                        )
+                    cur.execute(*self._sql_update(processamento_id, inicio, fim, status, mensagem))
                 conn.commit()
         except Exception as e:
             self.logger.error("Erro ao atualizar execução: %s: %s", type(e).__name__, e)
 
+    def _finalizar_execucao(self, processamento_id: int, inicio: datetime, fim: datetime,
+                            status: str, mensagem: Optional[str], eventos: list) -> None:
+        """
+        UPDATE final de processamento + INSERT dos últimos eventos em uma única ida ao banco.
+        Os comandos vão juntos numa simple query em autocommit, que o PostgreSQL
+        executa como uma transação implícita (sem BEGIN/COMMIT separados).
+        """
+        try:
+            self._ensure_schema_introspection()
+            with self._get_conn() as conn:
+                if conn is None:
+                    self.logger.error("Conexão ao banco falhou (update).")
+                    return
+                with conn.cursor() as cur:
+                    partes = [cur.mogrify(*self._sql_update(processamento_id, inicio, fim, status, mensagem))]
+                    if eventos:
+                        valores = b", ".join(
+                            cur.mogrify("(%s, %s, %s, %s, %s, %s::jsonb, %s)", row) for row in eventos
+                        )
+                        partes.append(
+                            b"INSERT INTO processamento_log (processamento_id, level, etapa, codigo, mensagem, detalhe, stacktrace) VALUES "
+                            + valores
+                        )
+                    autocommit = conn.autocommit
+                    conn.autocommit = True
+                    try:
+                        cur.execute(b";\n".join(partes))
+                    finally:
+                        conn.autocommit = autocommit
+        except Exception as e:
+            self.logger.error("Erro ao finalizar execução: %s: %s", type(e).__name__, e)
+
     def registrar_evento(
         self,
         processamento_id: int,
@@ -284,29 +587,140 @@ class ProcessLogger:
         mensagem: Optional[str] = None,
         detalhe: Optional[dict] = None,
         stacktrace: Optional[str] = None,
-    ) -> Optional[int]:
+    ) -> None:
+        """
+        Enfileira um evento para processamento_log sem bloquear o chamador.
+        A gravação é feita pela thread de fundo (_drain_loop), em lotes de até
+        flush_every eventos ou a cada flush_interval_s. Use `flush` para
+        aguardar a gravação do que já foi enfileirado.
+        """
+        lvl = self._norm_level(level)
+        detalhe_json = _json_dumps(detalhe) if isinstance(detalhe, (dict, list)) else (detalhe if isinstance(detalhe, str) else None)
+        self._enqueue((processamento_id, lvl, etapa, codigo, mensagem, detalhe_json, stacktrace))
+
+    def _enqueue(self, item: Any) -> None:
+        self._ensure_worker()
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                # Fila cheia: descarta o evento mais antigo, nunca bloqueia a aplicação
+                try:
+                    antigo = self._queue.get_nowait()
+                except queue.Empty:
+                    continue
+                if antigo is _PARAR:
+                    # o pedido de parada não pode se perder: volta à fila no lugar do item novo
+                    item, antigo = antigo, item
+                if isinstance(antigo, threading.Event):
+                    antigo.set()
+                else:
+                    self._eventos_descartados += 1
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(
+                target=self._drain_loop, name="ProcessLogger-db", daemon=True
+            )
+            self._worker.start()
+            _loggers_ativos.add(self)
+
+    def _drain_loop(self) -> None:
+        parar = False
+        while not parar:
+            item = self._queue.get()
+            rows: list = []
+            markers: list = []
+            deadline = time.monotonic() + self._flush_interval_s
+            while True:
+                if item is _PARAR:
+                    parar = True
+                    break  # grava o que já foi coletado e encerra a thread
+                if isinstance(item, threading.Event):
+                    markers.append(item)
+                    break  # flush solicitado: grava o que já foi coletado
+                rows.append(item)
+                if len(rows) >= self._flush_every:
+                    break
+                restante = deadline - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=restante)
+                except queue.Empty:
+                    break
+            try:
+                self._flush_events(rows)
+            except Exception:
+                pass  # _flush_events já registra o erro; a thread não pode morrer
+            for ev in markers:
+                ev.set()
+
+    def flush(self, timeout: Optional[float] = 5.0) -> bool:
+        """
+        Aguarda a gravação dos eventos enfileirados até o momento.
+        Retorna False se o timeout expirar antes.
+        """
+        if self._worker is None or not self._worker.is_alive():
+            return True
+        ev = threading.Event()
+        self._enqueue(ev)
+        ok = ev.wait(timeout)
+        if self._eventos_descartados:
+            self.logger.warning("%d evento(s) descartado(s) por fila cheia.", self._eventos_descartados)
+            self._eventos_descartados = 0
+        return ok
+
+    def close(self, timeout: Optional[float] = 5.0) -> None:
+        """
+        Grava os eventos pendentes e encerra a thread de gravação.
+        Um novo evento depois do close() inicia outra thread.
+        """
+        worker = self._worker
+        if worker is None or not worker.is_alive():
+            _loggers_ativos.discard(self)
+            return
+        self._enqueue(_PARAR)
+        worker.join(timeout)
+        if not worker.is_alive():
+            with self._worker_lock:
+                if self._worker is worker:
+                    self._worker = None
+            _loggers_ativos.discard(self)
+        if self._eventos_descartados:
+            self.logger.warning("%d evento(s) descartado(s) por fila cheia.", self._eventos_descartados)
+            self._eventos_descartados = 0
+
+    def _flush_events(self, rows: list) -> int:
+        """Grava os eventos em um único INSERT ... VALUES e um commit."""
+        if not rows:
+            return 0
         try:
-            lvl = self._norm_level(level)
-            detalhe_json = json.dumps(detalhe) if isinstance(detalhe, (dict, list)) else (detalhe if isinstance(detalhe, str) else None)
             with self._get_conn() as conn:
                 if conn is None:
                     self.logger.error("Conexão ao banco falhou (log_evento).")
-                    return None
+                    return 0
                 with conn.cursor() as cur:
-                    cur.execute(
+                    execute_values(
+                        cur,
                         """
                         INSERT INTO processamento_log (processamento_id, level, etapa, codigo, mensagem, detalhe, stacktrace)
-                        VALUES (%s, %s, %s, %s, %s, %s::jsonb, %s)
-                        RETURNING id
+                        VALUES %s
                         """,
-                        (processamento_id, lvl, etapa, codigo, mensagem, detalhe_json, stacktrace),
+                        rows,
+                        template="(%s, %s, %s, %s, %s, %s::jsonb, %s)",
+                        page_size=500,
                     )
-                    new_id = cur.fetchone()[0]
                 conn.commit()
-            return new_id
+            return len(rows)
         except Exception as e:
-            self.logger.error("Erro ao registrar evento: %s: %s", type(e).__name__, e)
-            return None
+            self.logger.error("Erro ao registrar %d evento(s): %s: %s", len(rows), type(e).__name__, e)
+            return 0
 
     def registrar_execucao(
         self,
@@ -332,24 +746,10 @@ class ProcessLogger:
                     self.logger.error("Conexão ao banco falhou.")
                     return None
                 with conn.cursor() as cur:
-                    if self._has_mensagem_col:
-                        cur.execute(
-                            """
-                            INSERT INTO processamento (nome_processo, inicio, fim, usuario, status, mensagem)
-                            VALUES (%s, %s, %s, %s, %s, %s)
-                            RETURNING id
-                            """,
-                            (nome_processo, inicio, fim, usuario, status, mensagem),
-                        )
-                    else:
-                        cur.execute(
-                            """
-                            INSERT INTO processamento (nome_processo, inicio, fim, usuario, status)
-                            VALUES (%s, %s, %s, %s, %s)
-                            RETURNING id
-                            """,
-                            (nome_processo, inicio, fim, usuario, status),
-                        )
+                    cur.execute(
+                        self._insert_sql,
+                        self._insert_row(nome_processo, inicio, fim, usuario, status, mensagem),
+                    )
                     new_id = cur.fetchone()[0]
                 conn.commit()
             return new_id
@@ -363,30 +763,29 @@ class ProcessLogger:
         inicio = self._now_utc()
         proc_id = self.registrar_inicio(nome_processo=nome_processo, usuario=usuario)
         status_final = self._status_success()
+        evento_final = None
         try:
             yield
         except Exception as e:
             status_final = self._status_error()
             tb = traceback.format_exc()
             self.log_mensagem(f"Exceção: {type(e).__name__}: {e}", level="ERROR", etapa="runtime", codigo="UNHANDLED_EXCEPTION")
-            self.registrar_evento(
-                processamento_id=proc_id or 0,
-                level="ERROR",
-                etapa="runtime",
-                codigo="TRACEBACK",
-                mensagem=str(e),
-                detalhe=None,
-                stacktrace=tb,
-            )
+            # gravado junto com o UPDATE final, na mesma ida ao banco
+            evento_final = (proc_id or 0, "ERROR", "runtime", "TRACEBACK", str(e), None, tb)
             raise
         finally:
+            self.flush()
             fim = self._now_utc()
             resumo = self._buffer_compacto()
             if proc_id:
-                self.atualizar_execucao(
+                self._finalizar_execucao(
                     processamento_id=proc_id,
                     inicio=inicio,
                     fim=fim,
                     status=status_final,
                     mensagem=resumo,
+                    eventos=[evento_final] if evento_final else [],
                 )
+            elif evento_final:
+                self._flush_events([evento_final])
+            self.close()
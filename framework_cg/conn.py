@@ -1,59 +1,204 @@
 import os
-from typing import Dict, Optional, Iterator
+import hashlib
+import threading
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Iterator, Sequence, Any
 from contextlib import contextmanager
 
-from dotenv import load_dotenv
-from psycopg2 import connect, Error as PsycopgError
+import numpy as np
+from psycopg2 import Error as PsycopgError
+from psycopg2.extensions import connection as _PgConnection, adapt, register_adapter
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 
+# .env/config/.env são carregados uma única vez, na importação de alarmistica
 from framework_cg.alarmistica import ProcessLogger
 
-load_dotenv('.env')
-
 logger = ProcessLogger(usuario='sistema', db_name=os.getenv('DB_NAME'))
 
 
+def _adaptar_escalar_numpy(valor):
+    # .item() devolve o tipo Python equivalente, que o psycopg2 já sabe citar
+    # (inteiros negativos, NaN/Infinity, bool); datetime64 NaT vira None -> NULL
+    return adapt(valor.item())
+
+
+def _adaptar_datetime64(valor):
+    return adapt(valor.astype('datetime64[us]').item())
+
+
+# Escalares numpy (ex.: valores vindos de um DataFrame em filtros/parâmetros) passam
+# direto para o psycopg2, sem conversão manual. float64 é subclasse de float, mas no
+# numpy 2 o repr dele ('np.float64(2.5)') quebraria o adaptador padrão de float.
+for _tipo in (np.int8, np.int16, np.int32, np.int64, np.uint8, np.uint16, np.uint32, np.uint64,
+              np.float16, np.float32, np.float64, np.bool_):
+    register_adapter(_tipo, _adaptar_escalar_numpy)
+register_adapter(np.datetime64, _adaptar_datetime64)
+
+
+@lru_cache(maxsize=8)
+def _params_for(db_name: Optional[str] = None) -> Mapping[str, Any]:
+    """Parâmetros de conexão lidos do ambiente uma vez por db_name (somente leitura)."""
+    dsn = os.getenv('DATABASE_URL')
+    if dsn:
+        return MappingProxyType({"dsn": dsn})
+
+    host = os.getenv('DB_HOST')
+    port = os.getenv('DB_PORT')
+    user = os.getenv('DB_USER')
+    password = os.getenv('DB_PASSWORD')
+    name = db_name or os.getenv('DB_NAME')
+
+    return MappingProxyType({
+        "host": host,
+        "port": int(port) if port else None,
+        "user": user,
+        "password": password,
+        "dbname": name,
+        "connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "10")),
+        "keepalives": 1,
+        "keepalives_idle": int(os.getenv("DB_KEEPALIVE_IDLE", "30")),
+        "keepalives_interval": int(os.getenv("DB_KEEPALIVE_INTERVAL", "10")),
+        "keepalives_count": int(os.getenv("DB_KEEPALIVE_COUNT", "5")),
+        "sslmode": os.getenv("DB_SSLMODE", None) or None,
+    })
+
+
+class _PooledConnection(_PgConnection):
+    """Conexão do pool; guarda os prepared statements já criados na sessão."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared: set[str] = set()
+
+
+class _PoolComEspera(ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool que espera por uma conexão livre (até `timeout` segundos)
+    em vez de falhar na hora com PoolError quando as maxconn conexões estão em uso.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, *args, timeout: Optional[float] = None, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self._vagas = threading.BoundedSemaphore(maxconn)
+        self._timeout = timeout
+
+    def getconn(self, key=None):
+        if not self._vagas.acquire(timeout=self._timeout):
+            raise PoolError(f"nenhuma conexão livre no pool após {self._timeout}s")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._vagas.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        super().putconn(conn, key, close)
+        # só libera a vaga de conexões que eram do pool (putconn falha nas demais)
+        self._vagas.release()
+
+
 class PostgresConnection:
+    # Pools compartilhados pelo processo inteiro, um por db_name.
+    _pools: Dict[Optional[str], _PoolComEspera] = {}
+    _pools_lock = threading.Lock()
+
     def __init__(self) -> None:
         self.logger = logger
 
     def carregar_variaveis_ambiente(self, db_name: Optional[str] = None) -> Dict[str, str]:
-        dsn = os.getenv('DATABASE_URL')  
-        if dsn:
-            return {"dsn": dsn}
-
-        host = os.getenv('DB_HOST')
-        port = os.getenv('DB_PORT')
-        user = os.getenv('DB_USER')
-        password = os.getenv('DB_PASSWORD')
-        name = db_name or os.getenv('DB_NAME')
+        return dict(_params_for(db_name))
 
+    @staticmethod
+    def _limites_pool() -> Dict[str, Any]:
         return {
-            "host": host,
-            "port": int(port) if port else None,
-            "user": user,
-            "password": password,
-            "dbname": name,
-            "connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "10")),
-            "keepalives": 1,
-            "keepalives_idle": int(os.getenv("DB_KEEPALIVE_IDLE", "30")),
-            "keepalives_interval": int(os.getenv("DB_KEEPALIVE_INTERVAL", "10")),
-            "keepalives_count": int(os.getenv("DB_KEEPALIVE_COUNT", "5")),
-            "sslmode": os.getenv("DB_SSLMODE", None) or None, 
+            "minconn": int(os.getenv("DB_POOL_MIN", "1")),
+            "maxconn": int(os.getenv("DB_POOL_MAX", "10")),
+            # segundos de espera por uma conexão livre antes do PoolError
+            "timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
         }
 
+    def _get_pool(self, db_name: Optional[str] = None) -> _PoolComEspera:
+        """
+        Retorna o pool do banco, criando-o na primeira chamada.
+        O pool é compartilhado entre todas as instâncias de PostgresConnection.
+        """
+        key = db_name or os.getenv('DB_NAME')
+        pool = self._pools.get(key)
+        if pool is not None:
+            return pool
+        with self._pools_lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                params = _params_for(key)
+                pool = _PoolComEspera(
+                    **self._limites_pool(), connection_factory=_PooledConnection, **params
+                )
+                self._pools[key] = pool
+        return pool
+
+    @staticmethod
+    def preparar(cursor, query: str, n_params: int) -> Optional[str]:
+        """
+        Garante o PREPARE de `query` (placeholders %s) na conexão do cursor e retorna o nome
+        do statement. O PREPARE é feito uma vez por conexão do pool.
+        Conexões fora do pool (sem registro de statements) retornam None.
+        """
+        preparados = getattr(cursor.connection, "prepared", None)
+        if preparados is None:
+            return None
+
+        nome = "q_" + hashlib.md5(query.encode("utf-8")).hexdigest()[:16]
+        if nome not in preparados:
+            # %s -> $1..$n, com a mesma regra de escape (%%) do psycopg2
+            corpo = query % tuple(f"${i}" for i in range(1, n_params + 1)) if n_params else query
+            cursor.execute(f"PREPARE {nome} AS {corpo}")
+            preparados.add(nome)
+        return nome
+
+    @staticmethod
+    def executar_preparado(cursor, query: str, params: Optional[Sequence[Any]] = None) -> None:
+        """
+        Executa `query` (placeholders %s) como prepared statement da conexão.
+        O PREPARE é feito uma vez por conexão do pool; as chamadas seguintes fazem
+        apenas EXECUTE, sem parse/plan no servidor.
+        Conexões fora do pool (sem registro de statements) executam normalmente.
+        """
+        params = tuple(params or ())
+        nome = PostgresConnection.preparar(cursor, query, len(params))
+        if nome is None:
+            cursor.execute(query, params or None)
+        elif params:
+            cursor.execute(f"EXECUTE {nome} ({', '.join(['%s'] * len(params))})", params)
+        else:
+            cursor.execute(f"EXECUTE {nome}")
 
     @contextmanager
     def conectar_postgres(self, db_name: str = None):
-        params = self.carregar_variaveis_ambiente(db_name)
+        """
+        Empresta uma conexão do pool e a devolve ao sair do bloco; com o pool cheio, espera
+        até DB_POOL_TIMEOUT segundos por uma conexão livre.
+        Em caso de erro a conexão é descartada (fechada) em vez de voltar ao pool.
+        """
+        pool = None
         conn = None
         try:
-            conn = connect(**params)
-            self.logger.log_mensagem('Conexão com PostgreSQL estabelecida com sucesso.', level='info')
+            pool = self._get_pool(db_name)
+            conn = pool.getconn()
+            # Conexões do pool sempre saem em modo transacional, mesmo que um uso
+            # anterior tenha ligado autocommit sem restaurar
+            if conn.autocommit:
+                conn.autocommit = False
+            self.logger.log_mensagem('Conexão com PostgreSQL obtida do pool.', level='info')
             yield conn
         except Exception as e:
             self.logger.log_mensagem(f'Erro ao conectar/operar no PostgreSQL: {type(e).__name__} - {e}', level='error')
-            raise 
+            if conn is not None:
+                pool.putconn(conn, close=True)
+                conn = None
+            raise
         finally:
-            if conn and not conn.closed:
-                conn.close()
-                self.logger.log_mensagem('Conexão com PostgreSQL fechada com sucesso.', level='info')
+            if conn is not None:
+                # putconn faz rollback de transações pendentes antes de reaproveitar
+                pool.putconn(conn)
+                self.logger.log_mensagem('Conexão com PostgreSQL devolvida ao pool.', level='info')
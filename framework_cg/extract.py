@@ -1,16 +1,109 @@
+import io
 import os
 import shutil
+import uuid
 import pandas as pd
 import traceback
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2 import sql
 from framework_cg.alarmistica import ProcessLogger
 from framework_cg.conn import PostgresConnection
 from typing import Optional
 
+try:
+    import pyarrow.csv as pacsv  # opcional: pip install "framework-cg[arrow]"
+except ImportError:
+    pacsv = None
+
+_EXTENSOES_VALIDAS = ('.csv', '.xlsx', '.xls')
+
+# Linhas por lote no cursor de servidor de read_data_db
+_ITERSIZE = 50_000
+
+# Operadores aceitos nos filtros parametrizados {coluna: (operador, valor)}
+_OPERADORES = {
+    '=': '= {}', '!=': '<> {}', '<>': '<> {}', '<': '< {}', '<=': '<= {}', '>': '> {}', '>=': '>= {}',
+    'LIKE': 'LIKE {}', 'NOT LIKE': 'NOT LIKE {}', 'ILIKE': 'ILIKE {}', 'NOT ILIKE': 'NOT ILIKE {}',
+    # IN vira ANY/ALL com array para funcionar também como prepared statement
+    'IN': '= ANY({})', 'NOT IN': '<> ALL({})',
+    # IS/IS NOT não aceitam parâmetro; DISTINCT FROM tem a mesma semântica para NULL/TRUE/FALSE
+    'IS': 'IS NOT DISTINCT FROM {}', 'IS NOT': 'IS DISTINCT FROM {}',
+}
+
+_AND = sql.SQL(' AND ').join
+_COMMA = ', '.join
+
+
+def _sql_cru(texto: str, escapar: bool) -> sql.SQL:
+    # Com parâmetros, o psycopg2 interpreta '%' do SQL cru como placeholder: vira '%%'
+    return sql.SQL(texto.replace('%', '%%') if escapar else texto)
+
 class Extract:
     def __init__(self, usuario: str = 'sistema', db_name: str | None = None):
         self.logger = ProcessLogger(usuario=usuario, db_name=db_name)
         self.db_name = db_name
         self.conn_handler = PostgresConnection()
+        # EXTRACT_DEBUG=1 registra no log o SQL final de query_data_db
+        self.debug = bool(int(os.getenv('EXTRACT_DEBUG', '0')))
+        # Conexão compartilhada pelas leituras dentro de `session()`
+        self._conn = None
+        self._conn_db: Optional[str] = None
+        # Índice por pasta: {pasta: (mtime_ns, {nome_base_minúsculo: nome_real})}
+        self._dir_index: dict[str, tuple[int, dict[str, str]]] = {}
+
+    @contextmanager
+    def session(self, db_name: str = None):
+        '''
+        Mantém uma única conexão para várias leituras:
+
+            with extract.session():
+                a = extract.read_data_db('tabela_a')
+                b = extract.query_data_db('tabela_b', ...)
+
+        Dentro do bloco, read_data_db/query_data_db sem db_name (ou com o mesmo db_name)
+        reaproveitam a conexão em vez de pegar uma do pool a cada chamada.
+        '''
+        if self._conn is not None:
+            yield self._conn
+            return
+        with self.conn_handler.conectar_postgres(db_name=db_name) as conn:
+            self._conn, self._conn_db = conn, db_name
+            try:
+                yield conn
+            finally:
+                self._conn, self._conn_db = None, None
+
+    @contextmanager
+    def _conexao(self, db_name: str = None):
+        if self._conn is None or db_name not in (None, self._conn_db):
+            with self.conn_handler.conectar_postgres(db_name=db_name) as conn:
+                yield conn
+            return
+        try:
+            yield self._conn
+        except Exception:
+            # não deixa a sessão presa numa transação abortada
+            self._conn.rollback()
+            raise
+
+    def _index_dir(self, pasta: str, forcar: bool = False) -> dict[str, str]:
+        '''
+        Indexa os arquivos válidos da pasta pelo nome base em minúsculas.
+        O índice é reaproveitado enquanto o mtime da pasta não mudar.
+        '''
+        mtime = os.stat(pasta).st_mtime_ns
+        cached = self._dir_index.get(pasta)
+        if cached and cached[0] == mtime and not forcar:
+            return cached[1]
+        index = {}
+        with os.scandir(pasta) as it:
+            for entry in it:
+                nome = entry.name.lower()
+                if nome.endswith(_EXTENSOES_VALIDAS):
+                    index.setdefault(os.path.splitext(nome)[0], entry.name)
+        self._dir_index[pasta] = (mtime, index)
+        return index
 
     def mover_arquivo(self, nome_original, destino_pasta, data, origem_pasta='C:/Users/User/Downloads/csv_files'):
         """
@@ -26,15 +119,11 @@ class Extract:
         str: Caminho completo do novo arquivo ou uma mensagem de erro.
         """
         try:
-            arquivos = os.listdir(origem_pasta)
-            arquivo_encontrado = None
-            extensoes_validas = ('.csv', '.xlsx', '.xls')
             nome_base = os.path.splitext(nome_original)[0].lower()
-
-            for arq in arquivos:
-                if os.path.splitext(arq.lower())[0] == nome_base and arq.lower().endswith(extensoes_validas):
-                    arquivo_encontrado = arq
-                    break
+            arquivo_encontrado = self._index_dir(origem_pasta).get(nome_base)
+            if not arquivo_encontrado:
+                # o índice pode estar defasado dentro da resolução do mtime
+                arquivo_encontrado = self._index_dir(origem_pasta, forcar=True).get(nome_base)
 
             if not arquivo_encontrado:
                 return self.logger.log_mensagem(
@@ -50,6 +139,10 @@ class Extract:
             caminho_destino = os.path.join(destino_pasta, novo_nome)
 
             shutil.move(caminho_origem, caminho_destino)
+            # Mantém o índice válido após a própria movimentação, sem reescanear a pasta
+            index = self._dir_index[origem_pasta][1]
+            index.pop(nome_base, None)
+            self._dir_index[origem_pasta] = (os.stat(origem_pasta).st_mtime_ns, index)
             return self.logger.log_mensagem(f'Arquivo movido com sucesso para: {caminho_destino}')
         
         except Exception as e:
@@ -61,45 +154,150 @@ class Extract:
             return None
         
         
+    def _read_csv(self, arquivo: str) -> pd.DataFrame:
+        if pacsv is None:
+            return pd.read_csv(arquivo, sep=';')
+        table = pacsv.read_csv(
+            arquivo,
+            read_options=pacsv.ReadOptions(use_threads=True, block_size=1 << 22),
+            parse_options=pacsv.ParseOptions(delimiter=';'),
+            # como no pd.read_csv, campo vazio (ou 'NA', 'null'...) em coluna de texto vira nulo
+            convert_options=pacsv.ConvertOptions(strings_can_be_null=True),
+        )
+        return table.to_pandas(types_mapper=pd.ArrowDtype, self_destruct=True)
+
+    @staticmethod
+    def _montar_where(filters: dict) -> tuple[sql.Composable, list]:
+        '''
+        Monta a cláusula WHERE a partir dos filtros.
+        - {coluna: (operador, valor)}: coluna com quoting seguro e valor como parâmetro %s
+        - {coluna: "operador expressão"}: formato antigo, inserido como SQL cru
+        '''
+        clauses, params, legado = [], [], []
+        for col, cond in filters.items():
+            if isinstance(cond, str):
+                legado.append(len(clauses))
+                clauses.append(f'{col} {cond}')
+                continue
+            op, valor = cond
+            template = _OPERADORES.get(str(op).strip().upper())
+            if template is None:
+                raise ValueError(f'Operador de filtro não suportado: {op!r}')
+            if template.startswith(('= ANY', '<> ALL')):
+                valor = list(valor)
+            ident = sql.SQL('.').join(sql.Identifier(p.strip()) for p in col.split('.'))
+            clauses.append(sql.SQL('{} ' + template).format(ident, sql.Placeholder()))
+            params.append(valor)
+        for i in legado:
+            clauses[i] = _sql_cru(clauses[i], bool(params))
+        return sql.SQL(' WHERE ') + _AND(clauses), params
+
+    def _executar(self, cursor, query: str, params: list, prepare: bool) -> None:
+        if prepare:
+            self.conn_handler.executar_preparado(cursor, query, params)
+        else:
+            cursor.execute(query, params or None)
+
+    @staticmethod
+    def _copy_to_df(conn, query: str, params: list = None) -> pd.DataFrame:
+        '''
+        Executa a consulta via COPY (...) TO STDOUT em CSV e monta o DataFrame a partir do buffer.
+        Evita a conversão linha a linha do fetchall; os tipos são inferidos do texto do CSV.
+        '''
+        buf = io.BytesIO()
+        with conn.cursor() as cursor:
+            # COPY não aceita parâmetros: os valores são interpolados no cliente
+            query_bytes = cursor.mogrify(query, params or None).strip().rstrip(b';')
+            cursor.copy_expert(b"COPY (" + query_bytes + b") TO STDOUT WITH (FORMAT CSV, HEADER)", buf)
+        buf.seek(0)
+        # NULL do COPY é vazio sem aspas; '' entre aspas é string vazia.
+        # Textos como 'NA', 'null' e 'nan' continuam sendo texto (sem null_values padrão).
+        # O pandas não distingue campo vazio com/sem aspas: ali '' também vira nulo.
+        # boolean sai do COPY como t/f: true_values/false_values devolvem colunas bool
+        if pacsv is None:
+            return pd.read_csv(buf, keep_default_na=False, na_values=[''],
+                               true_values=['t'], false_values=['f'])
+        table = pacsv.read_csv(
+            buf,
+            convert_options=pacsv.ConvertOptions(
+                null_values=[''], strings_can_be_null=True, quoted_strings_can_be_null=False,
+                true_values=['t'], false_values=['f'],
+            ),
+        )
+        return table.to_pandas(types_mapper=pd.ArrowDtype, self_destruct=True)
+
     def read_multiple_csv(self, files: dict[str, str]) -> dict[str, pd.DataFrame]:
         '''
-        Lê múltiplos arquivos CSV e retorna um dicionário de DataFrames.
+        Lê múltiplos arquivos CSV em paralelo e retorna um dicionário de DataFrames.
+        Com pyarrow instalado usa o parser multithread do Arrow (colunas ArrowDtype);
+        sem ele, cai no pandas.read_csv.
         '''
+        if not files:
+            return {}
         dfs = {}
-        for nome, arquivo in files.items():
-            try:
-                df = pd.read_csv(arquivo, sep=';')
-                dfs[nome] = df
-            except Exception as e:
-                self.logger.log_mensagem(f'Erro ao processar {arquivo}: {e}', level='error')
-                dfs[nome] = pd.DataFrame()
+        with ThreadPoolExecutor(max_workers=min(8, len(files))) as pool:
+            futures = {nome: pool.submit(self._read_csv, arquivo) for nome, arquivo in files.items()}
+            for nome, future in futures.items():
+                try:
+                    dfs[nome] = future.result()
+                except Exception as e:
+                    self.logger.log_mensagem(f'Erro ao processar {files[nome]}: {e}', level='error')
+                    dfs[nome] = pd.DataFrame()
         return dfs
 
 
-    def read_data_db(self, table_name: str, columns: list[str] = None, db_name: str = None, filters: dict[str, str] = None) -> pd.DataFrame:
+    def read_data_db(self, table_name: str, columns: list[str] = None, db_name: str = None, filters: dict = None,
+                     use_copy: bool = False, prepare: bool = False) -> pd.DataFrame:
         '''
         Executa SELECT em uma tabela do PostgreSQL com filtros opcionais.
+        Filtros: {coluna: (operador, valor)}, ex: {'loja': ('=', 'FO'), 'id': ('IN', [1, 2])};
+        o formato antigo {coluna: "operador expressão"} continua aceito (SQL cru).
+        Com use_copy=True o resultado é transferido via COPY em CSV (mais rápido para
+        volumes grandes, mas os tipos das colunas são inferidos do texto).
+        Com prepare=True a consulta vira prepared statement da conexão (PREPARE uma vez, EXECUTE depois).
+        No caminho padrão as linhas vêm de um cursor de servidor em lotes de _ITERSIZE,
+        sem materializar o resultado inteiro como tuplas na memória.
         '''
-        cols = ', '.join(columns) if columns else '*'
+        cols = _COMMA(columns) if columns else '*'
 
-        where_clause = ''
-        if filters:
-            clauses = [f'{k} {v}' for k, v in filters.items()]
-            where_clause = 'WHERE ' + ' AND '.join(clauses)
+        where, params = self._montar_where(filters) if filters else (sql.SQL(''), [])
+        query = _sql_cru(f'SELECT {cols} FROM {table_name}', bool(params)) + where
 
-        sql = f'SELECT {cols} FROM {table_name} {where_clause}'
-
-        with self.conn_handler.conectar_postgres(db_name=db_name) as conn:
+        with self._conexao(db_name=db_name) as conn:
             if conn is None:
                 return pd.DataFrame()
             try:
-                with conn.cursor() as cursor:
-                    cursor.execute(sql)
-                    rows = cursor.fetchall()
-                    colnames = [desc[0] for desc in cursor.description]
-                    return pd.DataFrame(rows, columns=colnames)
+                query_str = query.as_string(conn)
+                if use_copy:
+                    return self._copy_to_df(conn, query_str, params)
+                if prepare:
+                    # DECLARE ... CURSOR não aceita EXECUTE: prepared usa cursor comum
+                    with conn.cursor() as cursor:
+                        self._executar(cursor, query_str, params, prepare)
+                        rows = cursor.fetchall()
+                        colnames = [desc[0] for desc in cursor.description]
+                        return pd.DataFrame(rows, columns=colnames)
+                with conn.cursor(name=f'ext_{uuid.uuid4().hex}') as cursor:
+                    cursor.itersize = _ITERSIZE
+                    cursor.execute(query_str, params or None)
+                    frames = []
+                    while True:
+                        rows = cursor.fetchmany(_ITERSIZE)
+                        # em cursor nomeado, description só existe após o primeiro fetch
+                        colnames = [desc[0] for desc in cursor.description]
+                        if not rows:
+                            break
+                        frames.append(pd.DataFrame(rows, columns=colnames))
+                    if not frames:
+                        return pd.DataFrame(columns=colnames)
+                    if len(frames) == 1:
+                        return frames[0]
+                    # lote só com NULL numa coluna vira object e contamina o concat: reinfere o dtype
+                    return pd.concat(frames, ignore_index=True).infer_objects()
             except Exception as e:
                 self.logger.log_mensagem(f'Erro ao ler dados da tabela {table_name}: {type(e).__name__} - {e}', level='error')
+                if conn is self._conn:
+                    conn.rollback()
                 return pd.DataFrame()
             
     def query_data_db(
@@ -107,14 +305,16 @@ class Extract:
         table: str,
         columns: list[str] = None,
         db_name: str = None,
-        filters: dict[str, str] = None,
+        filters: dict = None,
         joins: list[str] = None,
         aggregations: list[str] = None,
         group_by: list[str] = None,
         order_by: str = None,
         limit: int = None,
         offset: int = None,
-        custom_sql: str = None
+        custom_sql: str = None,
+        use_copy: bool = False,
+        prepare: bool = False
     ) -> pd.DataFrame:
         """
         Executa uma query dinâmica no PostgreSQL com filtros, joins, agregações, group by e mais.
@@ -123,7 +323,8 @@ class Extract:
             - table (str): Tabela base
             - columns (list[str]): Lista de colunas a selecionar (ignorado se houver aggregations ou custom_sql)
             - db_name (str): Nome do banco (opcional)
-            - filters (dict[str, str]): Dicionário de filtros no formato {coluna: operador_expressão}, ex: {'loja': "= 'FO'"}
+            - filters (dict): Filtros parametrizados {coluna: (operador, valor)}, ex: {'loja': ('=', 'FO')}.
+              O formato antigo {coluna: operador_expressão}, ex: {'loja': "= 'FO'"}, é inserido como SQL cru.
             - joins (list[str]): Lista de cláusulas JOIN completas
             - aggregations (list[str]): Lista de expressões agregadas (ex: ['SUM(valor) AS total'])
             - group_by (list[str]): Lista de colunas para agrupar
@@ -131,43 +332,58 @@ class Extract:
             - limit (int): Limite de registros
             - offset (int): Offset para paginação
             - custom_sql (str): Query SQL completa manual (ignora todos os outros parâmetros)
+            - use_copy (bool): Transfere o resultado via COPY em CSV (tipos inferidos do texto)
+            - prepare (bool): Executa como prepared statement da conexão (PREPARE uma vez, EXECUTE depois)
 
         Retorna:
             pd.DataFrame: Resultado da consulta
         """
         try:
+            params = []
             if custom_sql:
-                sql = custom_sql
+                query = sql.SQL(custom_sql)
             else:
-                select_clause = ', '.join(aggregations or columns or ['*'])
+                select_clause = _COMMA(aggregations or columns or ['*'])
+
+                # Parâmetros só vêm dos filtros; com eles, todo fragmento cru escapa '%'
+                where = None
+                if filters:
+                    where, params = self._montar_where(filters)
+                escapar = bool(params)
 
-                sql = f'SELECT {select_clause} FROM {table}'
+                # Partes acumuladas numa lista e compostas uma única vez no final
+                partes = [_sql_cru(f'SELECT {select_clause} FROM {table}', escapar)]
 
                 if joins:
-                    sql += ' ' + ' '.join(joins)
+                    partes.append(_sql_cru(' ' + ' '.join(joins), escapar))
 
-                if filters:
-                    where = ' AND '.join([f'{k} {v}' for k, v in filters.items()])
-                    sql += f' WHERE {where}'
+                if where is not None:
+                    partes.append(where)
 
                 if group_by:
-                    sql += ' GROUP BY ' + ', '.join(group_by)
+                    partes.append(_sql_cru(' GROUP BY ' + _COMMA(group_by), escapar))
 
                 if order_by:
-                    sql += f' ORDER BY {order_by}'
+                    partes.append(_sql_cru(f' ORDER BY {order_by}', escapar))
 
+                # LIMIT/OFFSET como literais inteiros validados, sem criar parâmetros
                 if limit:
-                    sql += f' LIMIT {limit}'
+                    partes.append(sql.SQL(f' LIMIT {int(limit)}'))
                 if offset:
-                    sql += f' OFFSET {offset}'
+                    partes.append(sql.SQL(f' OFFSET {int(offset)}'))
 
-            self.logger.log_mensagem(f'[DEBUG] Query executada:\n{sql}', level='info')
+                query = sql.Composed(partes)
 
-            with self.conn_handler.conectar_postgres(db_name=db_name) as conn:
+            with self._conexao(db_name=db_name) as conn:
                 if conn is None:
                     return pd.DataFrame()
+                query_str = query.as_string(conn)
+                if self.debug:
+                    self.logger.log_mensagem(f'[DEBUG] Query executada:\n{query_str}', level='info')
+                if use_copy:
+                    return self._copy_to_df(conn, query_str, params)
                 with conn.cursor() as cursor:
-                    cursor.execute(sql)
+                    self._executar(cursor, query_str, params, prepare)
                     rows = cursor.fetchall()
                     colnames = [desc[0] for desc in cursor.description]
                     return pd.DataFrame(rows, columns=colnames)
@@ -1,19 +1,44 @@
+import io
 import os
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional
 import numpy as np
 import pandas as pd
 import psycopg2
-from psycopg2.extras import execute_values
+from psycopg2.extras import execute_batch, execute_values
 from psycopg2 import sql
 from framework_cg.alarmistica import ProcessLogger
 from framework_cg.conn import PostgresConnection
 
+try:
+    import pyarrow as pa  # opcional: pip install "framework-cg[arrow]"
+except ImportError:
+    pa = None
+
+# A partir deste número de linhas simple_insert usa COPY ... FROM STDIN
+_COPY_THRESHOLD = 20_000
+
+# Valores que o CSV do COPY não representa (bytea, arrays, json...): esses DFs usam VALUES
+_TIPOS_SEM_CSV = (bytes, bytearray, memoryview, list, tuple, dict, set)
+# Valores de colunas object que _df_to_tuples converte um a um com _to_native
+_TIPOS_NAO_NATIVOS = (pd.Timedelta, pd.Timestamp, np.generic)
+# Marcador de NULL do CSV do COPY; um texto igual a ele seria gravado como NULL
+_NULO_COPY = '\\N'
+
+# A partir deste número de linhas upsert_df com max_workers > 1 divide a carga entre conexões
+_PARALLEL_THRESHOLD = 100_000
+
+# durable=False: commit sem esperar o flush do WAL (vale só para a transação da carga)
+_SQL_NAO_DURAVEL = "SET LOCAL synchronous_commit = OFF"
+
 
 class DataLoader:
     def __init__(self, db_name: Optional[str] = None):
         self.db_name = db_name
         self.conn_handler = PostgresConnection()
         self.logger = ProcessLogger(usuario='sistema', db_name=db_name)
+        # SQL já serializado por (operação, tabela, colunas, opções); identificadores não dependem da conexão
+        self._sql_cache: dict[tuple, tuple] = {}
 
     @staticmethod
     def _to_native(val):
@@ -36,6 +61,84 @@ class DataLoader:
             return val.total_seconds()
         return val
 
+    @staticmethod
+    def _df_to_tuples(df: pd.DataFrame) -> Iterator[tuple]:
+        """
+        Equivalente vetorizado de _to_native aplicado ao DataFrame inteiro (coluna a coluna):
+        - datetime64 -> datetime
+        - timedelta64 -> segundos (float)
+        - demais dtypes -> tipos Python nativos (tolist); colunas object com Timedelta/Timestamp/
+          escalares numpy passam valor a valor por _to_native (Timedelta -> segundos)
+        - NaN/NaT -> None, apenas nas colunas que têm nulos
+        - colunas ArrowDtype (ex.: vindas de Extract com pyarrow) -> to_pylist do Arrow,
+          que já entrega datetime/Decimal/None sem passar por object
+        Retorna um iterador de tuplas na ordem das colunas de `df`; as tuplas são
+        montadas sob demanda, sem materializar a lista inteira.
+        """
+        colunas = []
+        for i in range(df.shape[1]):
+            s = df.iloc[:, i]
+            if (pa is not None and isinstance(s.dtype, pd.ArrowDtype)
+                    and not pa.types.is_duration(s.dtype.pyarrow_dtype)):
+                # durations seguem o caminho do pandas para virar segundos, como em _to_native
+                colunas.append(pa.array(s).to_pylist())
+                continue
+            if pd.api.types.is_datetime64_any_dtype(s.dtype):
+                s = pd.Series(s.dt.to_pydatetime(), index=s.index, dtype=object)
+            elif s.dtype.kind == 'm':  # timedelta64 e duration do Arrow
+                s = s.dt.total_seconds()
+            # Só colunas com nulos passam por object; as demais saem direto do tolist (tipos nativos)
+            nulos = s.isna()
+            if nulos.any():
+                s = s.astype(object).where(~nulos, None)
+            valores = s.tolist()
+            if s.dtype == object and any(issubclass(t, _TIPOS_NAO_NATIVOS) for t in set(map(type, valores))):
+                valores = [DataLoader._to_native(v) for v in valores]
+            colunas.append(valores)
+        return zip(*colunas)
+
+    @staticmethod
+    def _csv_compativel(df: pd.DataFrame) -> bool:
+        """
+        False se alguma coluna object tiver bytes/listas/dicts/tuplas, que só o caminho VALUES adapta,
+        ou se alguma coluna de texto tiver o texto '\\N', que o COPY gravaria como NULL.
+        """
+        for i in range(df.shape[1]):
+            s = df.iloc[:, i]
+            if s.dtype == object:
+                if any(issubclass(t, _TIPOS_SEM_CSV) for t in set(map(type, s.tolist()))):
+                    return False
+            elif not (pd.api.types.is_string_dtype(s.dtype) or isinstance(s.dtype, pd.CategoricalDtype)):
+                continue
+            if s.isin([_NULO_COPY]).any():
+                return False
+        return True
+
+    @staticmethod
+    def _df_to_csv(df: pd.DataFrame) -> io.StringIO:
+        """
+        Serializa o DataFrame em CSV (sem cabeçalho) para COPY ... FROM STDIN WITH (FORMAT CSV, NULL '\\N').
+        - NaN/NaT/NA -> \\N
+        - timedelta64 -> segundos (float), como em _df_to_tuples
+        - float com todos os valores inteiros (int que virou float por causa de NaN) -> Int64,
+          para não enviar '1.0' a colunas inteiras (só quando cabe em int64)
+        """
+        colunas = []
+        for i in range(df.shape[1]):
+            s = df.iloc[:, i]
+            if s.dtype.kind == 'm':  # timedelta64 e duration do Arrow
+                s = s.dt.total_seconds()
+            elif pd.api.types.is_float_dtype(s.dtype):
+                valores = s.dropna().to_numpy()
+                if (len(valores) and np.isfinite(valores).all() and (valores % 1 == 0).all()
+                        and valores.min() >= -2.0 ** 63 and valores.max() < 2.0 ** 63):
+                    s = s.astype("Int64")
+            colunas.append(s)
+        buf = io.StringIO()
+        pd.concat(colunas, axis=1, ignore_index=True).to_csv(buf, index=False, header=False, na_rep=_NULO_COPY)
+        buf.seek(0)
+        return buf
+
     def transform_tuple(self, df: pd.DataFrame):
         """Transforma o DataFrame em colunas e lista de tuplas para inserção (não usada no upsert_df)."""
         cols = list(df.columns)
@@ -66,30 +169,49 @@ class DataLoader:
             return sql.SQL('.').join([sql.Identifier(schema), sql.Identifier(tbl)])
         return sql.Identifier(table)
 
-    def simple_insert(self, table: str, df: pd.DataFrame, page_size: int = 1000) -> int:
+    @staticmethod
+    def _selecionar_colunas(df: pd.DataFrame, columns: Optional[List[str]]) -> pd.DataFrame:
+        """df[columns] apenas quando columns difere das colunas do DF (evita cópia desnecessária)."""
+        if columns is None:
+            return df
+        columns = list(columns)
+        return df if columns == df.columns.tolist() else df[columns]
+
+    def simple_insert(self, table: str, df: pd.DataFrame, page_size: int = 1000,
+                      copy_threshold: Optional[int] = _COPY_THRESHOLD, durable: bool = True,
+                      columns: Optional[List[str]] = None) -> int:
         """
         INSERT em lote usando VALUES %s.
+        - A partir de `copy_threshold` linhas usa COPY ... FROM STDIN em CSV
+          (None desativa); DFs com bytes/listas/dicts/tuplas usam sempre o caminho VALUES
+        - durable=False: SET LOCAL synchronous_commit = OFF na transação; um crash do servidor
+          logo após o commit pode perder a carga (use só para dados que podem ser recarregados)
+        - columns: subconjunto/ordem das colunas a inserir (padrão: todas as colunas do DF)
         - Converte NaN -> None
         - Usa quoting seguro para tabela/colunas
         - Faz commit explícito
-        Retorna quantidade de linhas inseridas (estimada pelo tamanho do `data`).
+        Retorna quantidade de linhas inseridas (estimada pelo tamanho do `df`).
         """
         if df is None or df.empty:
             self.logger.log_mensagem(f"DataFrame vazio para {table}.", level='warning')
             return 0
 
-        # Ordem determinística das colunas
-        insert_cols = list(df.columns)
-
-        # Evita NaN/NaT no psycopg2
-        df2 = df.where(pd.notnull(df), None)
+        # Ordem determinística das colunas; só reindexa quando `columns` difere do DF
+        df = self._selecionar_colunas(df, columns)
+        insert_cols = df.columns.tolist()
 
-        data = [tuple(self._to_native(v) for v in row)
-                for row in df2[insert_cols].itertuples(index=False, name=None)]
+        usar_copy = (copy_threshold is not None and len(df) >= copy_threshold
+                     and self._csv_compativel(df))
 
-        tbl = self._qualify_table(table)
-        cols = sql.SQL(', ').join(sql.Identifier(c) for c in insert_cols)
-        q = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(tbl, cols)
+        key = ('insert', table, tuple(insert_cols), usar_copy)
+        query_str = self._sql_cache.get(key, (None,))[0]
+        if query_str is None:
+            tbl = self._qualify_table(table)
+            cols = sql.SQL(', ').join(sql.Identifier(c) for c in insert_cols)
+            if usar_copy:
+                q = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT CSV, NULL '\\N')").format(tbl, cols)
+            else:
+                q = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(tbl, cols)
 
         try:
             with self.conn_handler.conectar_postgres(db_name=self.db_name) as conn:
@@ -97,13 +219,21 @@ class DataLoader:
                     self.logger.log_mensagem("Falha ao conectar ao banco.", level='error')
                     return 0
                 with conn.cursor() as cur:
-                    # `execute_values` precisa de string; usamos as_string com o cursor
-                    query_str = q.as_string(cur)
-                    execute_values(cur, query_str, data, page_size=page_size)
+                    # `execute_values`/`copy_expert` precisam de string; usamos as_string com o cursor
+                    if query_str is None:
+                        query_str = q.as_string(cur)
+                        self._sql_cache[key] = (query_str,)
+                    if not durable:
+                        cur.execute(_SQL_NAO_DURAVEL)
+                    if usar_copy:
+                        cur.copy_expert(query_str, self._df_to_csv(df))
+                    else:
+                        # Tipos nativos e NaN/NaT -> None, coluna a coluna
+                        execute_values(cur, query_str, self._df_to_tuples(df), page_size=page_size)
                 conn.commit()
 
-            self.logger.log_mensagem(f"{len(data)} linhas inseridas em {table}.", level='info')
-            return len(data)
+            self.logger.log_mensagem(f"{len(df)} linhas inseridas em {table}.", level='info')
+            return len(df)
 
         except psycopg2.Error as e:
             code = getattr(e, "pgcode", None)
@@ -114,6 +244,98 @@ class DataLoader:
             )
             return 0
 
+    @staticmethod
+    def _on_conflict_sql(tbl_base: sql.Identifier, conflict_cols: List[str],
+                         upd_cols: List[str], on_conflict: str) -> sql.Composed:
+        """Cláusula ON CONFLICT do upsert (DO NOTHING ou DO UPDATE sem updates no-op)."""
+        conflict_ident = sql.SQL(", ").join(sql.Identifier(c) for c in conflict_cols)
+
+        if on_conflict == "nothing" or not upd_cols:
+            return sql.SQL(" ON CONFLICT ({}) DO NOTHING").format(conflict_ident)
+        if on_conflict == "update":
+            set_pairs = sql.SQL(", ").join(
+                sql.SQL("{} = EXCLUDED.{}").format(sql.Identifier(c), sql.Identifier(c))
+                for c in upd_cols
+            )
+
+            # Uma única comparação de linha em vez de N IS DISTINCT FROM ligados por OR
+            where_diff = sql.SQL("ROW({}) IS DISTINCT FROM ROW({})").format(
+                sql.SQL(", ").join(sql.SQL("EXCLUDED.{}").format(sql.Identifier(c)) for c in upd_cols),
+                sql.SQL(", ").join(sql.SQL("{}.{}").format(tbl_base, sql.Identifier(c)) for c in upd_cols),
+            )
+            return (
+                sql.SQL(" ON CONFLICT ({}) DO UPDATE SET {} WHERE {}")
+                .format(conflict_ident, set_pairs, where_diff)
+            )
+        raise ValueError("on_conflict deve ser 'update' ou 'nothing'.")
+
+    def _upsert_sql(self, table: str, insert_cols: List[str], conflict_cols: List[str],
+                    exclude_update: set, on_conflict: str, method: str) -> tuple:
+        """
+        Monta os comandos do upsert: (INSERT ... VALUES %s ON CONFLICT ...) para method='values',
+        (CREATE TEMP TABLE, COPY, INSERT ... SELECT ... ON CONFLICT) para method='copy'
+        ou (INSERT ... VALUES (%s, ...) ON CONFLICT ...) de uma linha para method='prepared'.
+        """
+        tbl_qual = self._qual_name(table)
+        tbl_base = self._base_name(table)
+        cols_ident = [sql.Identifier(c) for c in insert_cols]
+        cols_str = sql.SQL(", ").join(cols_ident)
+
+        upd_cols = [c for c in insert_cols if c not in (set(conflict_cols) | exclude_update)]
+
+        on_conflict_sql = self._on_conflict_sql(tbl_base, conflict_cols, upd_cols, on_conflict)
+
+        if method == 'copy':
+            stg = sql.Identifier("_stg_upsert")
+            # Staging só com as colunas do DF (tipos da tabela destino, sem constraints)
+            stage_sql = sql.SQL(
+                "CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA"
+            ).format(stg, cols_str, tbl_qual)
+            copy_sql = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT CSV, NULL '\\N')").format(stg, cols_str)
+            full_sql = sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {}").format(
+                tbl_qual, cols_str, cols_str, stg) + on_conflict_sql
+            return stage_sql, copy_sql, full_sql
+        if method == 'prepared':
+            # Versão de uma linha, transformada em PREPARE na conexão
+            valores = sql.SQL(", ").join(sql.Placeholder() for _ in insert_cols)
+            return (sql.SQL("INSERT INTO {} ({}) VALUES ({})").format(tbl_qual, cols_str, valores)
+                    + on_conflict_sql,)
+        return (sql.SQL("INSERT INTO {} ({}) VALUES %s").format(tbl_qual, cols_str) + on_conflict_sql,)
+
+    @staticmethod
+    def _particionar(df: pd.DataFrame, conflict_cols: List[str], n: int) -> List[pd.DataFrame]:
+        """Divide o DF em até n partes pelo hash de conflict_cols (chaves iguais ficam juntas)."""
+        grupo = pd.util.hash_pandas_object(df[conflict_cols], index=False).to_numpy() % n
+        partes = [df[grupo == i] for i in range(n)]
+        return [p for p in partes if not p.empty]
+
+    def _executar_upsert(self, cur, queries: tuple, method: str, df: pd.DataFrame, chunk_size: int,
+                         durable: bool = True) -> None:
+        if not durable:
+            cur.execute(_SQL_NAO_DURAVEL)
+        if method == 'copy':
+            stage_str, copy_str, query_str = queries
+            cur.execute(stage_str)
+            cur.copy_expert(copy_str, self._df_to_csv(df))
+            cur.execute(query_str)
+        elif method == 'prepared':
+            nome = self.conn_handler.preparar(cur, queries[0], df.shape[1])
+            comando = (f"EXECUTE {nome} ({', '.join(['%s'] * df.shape[1])})"
+                       if nome is not None else queries[0])
+            # execute_batch junta page_size EXECUTEs por ida ao servidor
+            execute_batch(cur, comando, self._df_to_tuples(df), page_size=chunk_size)
+        else:
+            # execute_values consome o iterador em páginas de chunk_size
+            execute_values(cur, queries[0], self._df_to_tuples(df), page_size=chunk_size)
+
+    def _upsert_parte(self, queries: tuple, method: str, df: pd.DataFrame, chunk_size: int,
+                      durable: bool = True) -> None:
+        """Upsert de uma parte em uma conexão própria do pool, com commit próprio."""
+        with self.conn_handler.conectar_postgres(db_name=self.db_name) as conn:
+            with conn.cursor() as cur:
+                self._executar_upsert(cur, queries, method, df, chunk_size, durable)
+            conn.commit()
+
     def upsert_df(
         self,
         table: str,
@@ -121,13 +343,30 @@ class DataLoader:
         conflict_cols: List[str],                   
         exclude_update: Optional[List[str]] = None, 
         on_conflict: str = 'update',              
-        chunk_size: int = 10000
+        chunk_size: int = 10000,
+        method: str = 'values',
+        max_workers: int = 1,
+        durable: bool = True,
+        columns: Optional[List[str]] = None
     ) -> None:
         """
         UPSERT genérico com execute_values:
         - Usa conflict_cols como alvo do ON CONFLICT.
         - Atualiza todas as colunas do DF, exceto conflict_cols e exclude_update.
-        - Evita 'updates no-op' com WHERE IS DISTINCT FROM.
+        - Evita 'updates no-op' com WHERE ROW(...) IS DISTINCT FROM ROW(...).
+        - method='copy': COPY do DF para uma tabela TEMP de staging e um único
+          INSERT ... SELECT ... ON CONFLICT (mais rápido para volumes grandes).
+        - method='prepared': PREPARE do INSERT de uma linha (uma vez por conexão do pool)
+          e EXECUTEs em lote com execute_batch; evita parse/plan a cada chamada em cargas
+          incrementais pequenas/médias e repetidas na mesma tabela.
+        - max_workers > 1 (a partir de _PARALLEL_THRESHOLD linhas): as linhas são particionadas
+          por hash de conflict_cols e cada parte roda em uma conexão do pool, em paralelo.
+          Cada parte faz o próprio commit: se uma falhar, as outras podem já estar gravadas
+          (a carga deixa de ser atômica). Chaves iguais caem sempre na mesma parte; outros
+          índices únicos compartilhados entre partes ainda podem gerar espera/deadlock.
+        - durable=False: SET LOCAL synchronous_commit = OFF em cada transação da carga
+          (ver simple_insert).
+        - columns: subconjunto/ordem das colunas a gravar (padrão: todas as colunas do DF).
         """
         if df is None or df.empty:
             self.logger.log_mensagem(f"DataFrame vazio para {table}.", level='warning')
@@ -136,45 +375,32 @@ class DataLoader:
         conflict_cols = list(conflict_cols or [])
         if not conflict_cols:
             raise ValueError("conflict_cols não pode ser vazio para upsert.")
+        if method not in ('values', 'copy', 'prepared'):
+            raise ValueError("method deve ser 'values', 'copy' ou 'prepared'.")
 
         exclude_update = set(exclude_update or [])
 
-        insert_cols = list(df.columns)  # ordem determinística
-        data = [tuple(self._to_native(v) for v in row)
-                for row in df[insert_cols].itertuples(index=False, name=None)]
+        df = self._selecionar_colunas(df, columns)
+        insert_cols = df.columns.tolist()  # ordem determinística
 
-        tbl_qual = self._qual_name(table)
-        tbl_base = self._base_name(table)
-        cols_ident = [sql.Identifier(c) for c in insert_cols]
-        cols_str = sql.SQL(", ").join(cols_ident)
-
-        upd_cols = [c for c in insert_cols if c not in (set(conflict_cols) | exclude_update)]
-
-        insert_sql = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(tbl_qual, cols_str)
-
-        conflict_ident = sql.SQL(", ").join(sql.Identifier(c) for c in conflict_cols)
-
-        if on_conflict == "nothing" or not upd_cols:
-            on_conflict_sql = sql.SQL(" ON CONFLICT ({}) DO NOTHING").format(conflict_ident)
-        elif on_conflict == "update":
-            set_pairs = sql.SQL(", ").join(
-                sql.SQL("{} = EXCLUDED.{}").format(sql.Identifier(c), sql.Identifier(c))
-                for c in upd_cols
+        if method == 'copy' and not self._csv_compativel(df):
+            self.logger.log_mensagem(
+                f"Upsert em {table}: valores sem representação no CSV do COPY "
+                f"(bytes/listas/dicts ou texto '\\N'); usando method='values'.",
+                level='info'
             )
+            method = 'values'
 
-            where_diff = sql.SQL(" OR ").join(
-                sql.SQL("EXCLUDED.{c} IS DISTINCT FROM {t}.{c}")
-                .format(c=sql.Identifier(c), t=tbl_base)
-                for c in upd_cols
-            )
-            on_conflict_sql = (
-                sql.SQL(" ON CONFLICT ({}) DO UPDATE SET {} WHERE {}")
-                .format(conflict_ident, set_pairs, where_diff)
-            )
-        else:
-            raise ValueError("on_conflict deve ser 'update' ou 'nothing'.")
+        n_partes = 1
+        if max_workers > 1 and len(df) >= _PARALLEL_THRESHOLD:
+            # Mais partes que conexões no pool só deixaria workers esperando por vaga
+            n_partes = min(max_workers, self.conn_handler._limites_pool()["maxconn"])
 
-        full_sql = insert_sql + on_conflict_sql
+        key = ('upsert', table, tuple(insert_cols), tuple(conflict_cols),
+               tuple(sorted(exclude_update)), on_conflict, method)
+        queries = self._sql_cache.get(key)
+        if queries is None:
+            composed = self._upsert_sql(table, insert_cols, conflict_cols, exclude_update, on_conflict, method)
 
         try:
             with self.conn_handler.conectar_postgres(db_name=self.db_name) as conn:
@@ -182,11 +408,24 @@ class DataLoader:
                     self.logger.log_mensagem("Falha ao conectar ao banco.", level='error')
                     return
                 with conn.cursor() as cur:
-                    for i in range(0, len(data), chunk_size):
-                        chunk = data[i:i + chunk_size]
-                        execute_values(cur, full_sql.as_string(conn), chunk, page_size=len(chunk))
+                    # SQL serializado uma vez por combinação de tabela/colunas/opções
+                    if queries is None:
+                        queries = tuple(q.as_string(cur) for q in composed)
+                        self._sql_cache[key] = queries
+                    # Partes vazias são descartadas: com todas as chaves num só hash sobra uma parte
+                    partes = self._particionar(df, conflict_cols, n_partes) if n_partes > 1 else [df]
+                    if len(partes) > 1:
+                        # A primeira parte usa esta conexão; as demais, uma conexão do pool cada
+                        with ThreadPoolExecutor(max_workers=len(partes) - 1) as pool:
+                            futures = [pool.submit(self._upsert_parte, queries, method, parte, chunk_size, durable)
+                                       for parte in partes[1:]]
+                            self._executar_upsert(cur, queries, method, partes[0], chunk_size, durable)
+                            for future in futures:
+                                future.result()
+                    else:
+                        self._executar_upsert(cur, queries, method, df, chunk_size, durable)
                 conn.commit()
-            self.logger.log_mensagem(f"{len(data)} linhas processadas em {table}.", level='info')
+            self.logger.log_mensagem(f"{len(df)} linhas processadas em {table}.", level='info')
 
         except psycopg2.Error as e:
             code = getattr(e, "pgcode", None)
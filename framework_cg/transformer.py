@@ -1,32 +1,175 @@
+import numpy as np
 import pandas as pd
 import unidecode
 import hashlib
 import inspect
+from functools import lru_cache, wraps
+from typing import Optional
+
+try:
+    import xxhash  # opcional: pip install "framework-cg[hash]"
+except ImportError:
+    xxhash = None
+try:
+    import blake3  # opcional: pip install "framework-cg[hash]"
+except ImportError:
+    blake3 = None
+
+
+def _hasher(hash_algo: str):
+    """
+    Função bytes -> hexdigest do algoritmo escolhido.
+    'md5' (padrão) é o único sempre disponível; 'xxh128' e 'blake3' são bem mais rápidos.
+    'xxh128' não é criptográfico: serve para detecção de mudança/deduplicação, não para segurança.
+    """
+    if hash_algo == 'md5':
+        return lambda b: hashlib.md5(b).hexdigest()
+    if hash_algo == 'xxh128':
+        if xxhash is None:
+            raise ImportError('hash_algo="xxh128" requer o pacote xxhash (pip install "framework-cg[hash]").')
+        return xxhash.xxh128_hexdigest
+    if hash_algo == 'blake3':
+        if blake3 is None:
+            raise ImportError('hash_algo="blake3" requer o pacote blake3 (pip install "framework-cg[hash]").')
+        return lambda b: blake3.blake3(b).hexdigest()
+    raise ValueError(f'hash_algo não suportado: {hash_algo!r} (use "md5", "xxh128" ou "blake3").')
+
+
+# Nomes de coluna: acentos comuns -> ASCII, ' ' -> '_', '.' removido, em uma única passada em C
+_ACENTOS = 'áàâãäéèêëíìîïóòôõöúùûüçñÁÀÂÃÄÉÈÊËÍÌÎÏÓÒÔÕÖÚÙÛÜÇÑ'
+_SEM_ACENTOS = 'aaaaaeeeeiiiiooooouuuucnAAAAAEEEEIIIIOOOOOUUUUCN'
+_TABELA_COLUNAS = str.maketrans(_ACENTOS + ' ', _SEM_ACENTOS + '_', '.')
+
+
+def _limpar_nome_coluna(col: str) -> str:
+    limpo = col.strip().translate(_TABELA_COLUNAS).lower()
+    if limpo.isascii():
+        return limpo
+    # Sobrou caractere fora da tabela: caminho completo com unidecode
+    return unidecode.unidecode(col).strip().lower().replace(" ", "_").replace('.', '')
+
+
+@lru_cache(maxsize=200_000)
+def _norm(texto: str) -> str:
+    """unidecode + lower com cache: textos repetidos (cidades, categorias...) são normalizados uma vez."""
+    return unidecode.unidecode(texto).lower()
+
+
+@lru_cache(maxsize=None)
+def _parametros(func) -> tuple[frozenset, tuple[str, ...]]:
+    """
+    (nomes, obrigatórios) dos parâmetros de func; inspect.signature roda uma vez por função.
+    Os obrigatórios ficam na ordem da assinatura e excluem 'df', preenchido por `aplicar`.
+    """
+    params = inspect.signature(func).parameters
+    obrigatorios = tuple(
+        nome for nome, p in params.items()
+        if p.default is inspect.Parameter.empty and nome != 'df'
+    )
+    return frozenset(params), obrigatorios
+
+
+class _metodo_hash:
+    """
+    Método de hash que funciona pela classe e pela instância.
+    Transformer.gerar_hash_df(...) se comporta como staticmethod (hash_algo=None -> 'md5');
+    transformer.gerar_hash_df(...) usa o hash_algo da instância quando o argumento não é passado.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        # posição de hash_algo, para reconhecê-lo também quando passado por posição
+        self._pos = list(inspect.signature(func).parameters).index('hash_algo')
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self.func
+        func, pos = self.func, self._pos
+
+        @wraps(func)
+        def chamada(*args, **kwargs):
+            if len(args) <= pos and kwargs.get('hash_algo') is None:
+                kwargs['hash_algo'] = obj.hash_algo
+            return func(*args, **kwargs)
+        return chamada
 
 
 class Transformer:
-    def __init__(self, modulo_funcoes=None):
+    def __init__(self, modulo_funcoes=None, hash_algo: str = 'md5'):
         self.modulo_funcoes = modulo_funcoes
+        _hasher(hash_algo)  # valida o algoritmo (e a dependência) já na construção
+        # Padrão de gerar_hash_linha/gerar_hash_df chamados pela instância
+        self.hash_algo = hash_algo
 
     @staticmethod
     def limpar_colunas(df: pd.DataFrame) -> pd.DataFrame:
         '''
         Limpa os nomes das colunas do DataFrame: remove acentos, espaços, pontos, deixa tudo minúsculo.
         '''
-        df.columns = [
-            unidecode.unidecode(col).strip().lower().replace(" ", "_").replace('.', '')
+        # Nomes já limpos (ex.: parquet ou DF já tratado): mantém o Index original
+        if all(
+            isinstance(col, str) and col.isascii() and col == col.lower() and col == col.strip()
+            and ' ' not in col and '.' not in col
             for col in df.columns
-        ]
+        ):
+            return df
+        df.columns = [_limpar_nome_coluna(col) for col in df.columns]
         return df
 
-    @staticmethod
-    def gerar_hash_linha(row: pd.Series, key_columns = list[str]) -> str:
+    @_metodo_hash
+    def gerar_hash_linha(row: pd.Series, key_columns = list[str], hash_algo: Optional[str] = None) -> str:
         '''
-        Gera um hash MD5 único para uma linha do DataFrame.
+        Gera um hash único para uma linha do DataFrame. hash_algo=None usa o da instância ('md5' pela classe).
+        Para o DataFrame inteiro prefira gerar_hash_df, que evita o apply por linha.
         '''
         valores = [str(row[col]) for col in key_columns]
         linha_concatenada = ';'.join(valores)
-        return hashlib.md5(linha_concatenada.encode('utf-8')).hexdigest()
+        return _hasher(hash_algo or 'md5')(linha_concatenada.encode('utf-8'))
+
+    @staticmethod
+    def _coluna_str(s: pd.Series) -> pd.Series:
+        """Texto de cada valor da coluna, igual a str(valor) (nulos viram 'nan'/'NaT'/'None')."""
+        if s.dtype.kind in 'biuf' or isinstance(s.dtype, pd.StringDtype):
+            # conversão em C para os valores; nulos mantêm o str do próprio dtype
+            # ('nan' para NaN, '<NA>' para pd.NA em Int64/string)
+            texto = s.astype(str)
+            nulos = s.isna()
+            if nulos.any():
+                texto = texto.astype(object)
+                texto[nulos] = [str(v) for v in s[nulos].tolist()]
+            return texto
+        return s.astype(object).map(str)
+
+    @_metodo_hash
+    def gerar_hash_df(df: pd.DataFrame, key_columns: list[str], hash_algo: Optional[str] = None) -> pd.Series:
+        '''
+        Gera o hash (hash_algo=None usa o da instância; 'md5' pela classe) de cada linha do DataFrame a partir de key_columns (valores unidos por ';').
+        Versão vetorizada de gerar_hash_linha: a concatenação é feita por coluna.
+        '''
+        if df.empty:
+            return pd.Series([], index=df.index, dtype=object)
+        # Em df.apply(axis=1) cada linha chega com o dtype comum de todas as colunas
+        # (ex.: int + float -> float); a conversão segue o mesmo dtype para dar o mesmo texto
+        dtype_linha = df.iloc[0].dtype
+
+        def coluna(col: str) -> pd.Series:
+            s = df[col]
+            if s.dtype.kind == 'f' and s.dtype.itemsize < 8 and dtype_linha in (object, np.float64):
+                # float32/float16 (e Float32) chegam à linha como float64, também em linhas object:
+                # 0.1 em float32 vira '0.10000000149011612', não '0.1'
+                s = s.astype(np.float64 if isinstance(s.dtype, np.dtype) else 'Float64')
+            elif dtype_linha != object and s.dtype != dtype_linha:
+                s = s.astype(dtype_linha)
+            return Transformer._coluna_str(s)
+
+        texto = coluna(key_columns[0])
+        for col in key_columns[1:]:
+            texto = texto + ';' + coluna(col)
+        digest = _hasher(hash_algo or 'md5')
+        return pd.Series(
+            [digest(t.encode('utf-8')) for t in texto.tolist()],
+            index=df.index, dtype=object,
+        )
 
     @staticmethod
     def limpar_texto(texto) -> str:
@@ -35,7 +178,18 @@ class Transformer:
         '''
         if pd.isna(texto):
             return ''
-        return unidecode.unidecode(str(texto)).lower()
+        return _norm(str(texto))
+
+    @staticmethod
+    def limpar_serie(s: pd.Series) -> pd.Series:
+        '''
+        limpar_texto aplicado à Series inteira: cada valor distinto é normalizado uma única vez
+        (via categorias) e os nulos viram string vazia.
+        '''
+        cat = s.astype('category').cat
+        # código -1 (nulo) cai na última posição, que é ''
+        tabela = np.array([_norm(str(c)) for c in cat.categories] + [''], dtype=object)
+        return pd.Series(tabela[cat.codes.to_numpy()], index=s.index, name=s.name)
 
 
     def aplicar(self, df: pd.DataFrame, funcoes: list[str], **kwargs) -> pd.DataFrame:
@@ -48,17 +202,16 @@ class Transformer:
                 raise AttributeError(f'A função "{nome_funcao}" não foi encontrada no módulo.')
 
             func = getattr(self.modulo_funcoes, nome_funcao)
-            sig = inspect.signature(func)
-            params = sig.parameters
-
-            args = {}
-            for nome_param in params:
-                if nome_param == 'df':
-                    args[nome_param] = df
-                elif nome_param in kwargs:
-                    args[nome_param] = kwargs[nome_param]
-                elif params[nome_param].default is inspect.Parameter.empty:
-                    raise ValueError(f'O parâmetro obrigatório "{nome_param}" não foi passado para a função "{nome_funcao}".')
+
+            nomes, obrigatorios = _parametros(func)
+            faltando = set(obrigatorios).difference(kwargs)
+            if faltando:
+                nome_param = next(n for n in obrigatorios if n in faltando)
+                raise ValueError(f'O parâmetro obrigatório "{nome_param}" não foi passado para a função "{nome_funcao}".')
+
+            args = {n: kwargs[n] for n in nomes.intersection(kwargs)}
+            if 'df' in nomes:
+                args['df'] = df
 
             df = func(**args)
         return df